@@ -0,0 +1,14 @@
+from .dependencies import (
+    EVENT_BUFFER,
+    log_recognition_event,
+    create_event_indexes
+)
+from .router import ROUTER as EVENT_ROUTER
+
+
+__all__ = [
+    "EVENT_BUFFER",
+    "log_recognition_event",
+    "create_event_indexes",
+    "EVENT_ROUTER"
+]
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from src.facial_recognition_system.config import CONFIG
+from src.facial_recognition_system.database import MONGO_DB
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """
+    Write-behind buffer of recognition events.
+
+    Events are kept in memory and are written to the collection
+    with 'insert_many' when the batch is full or the interval is over.
+    If the buffer is full (e.g. Mongo is slow), new events are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        batch_size: int,
+        flush_interval: float,
+        max_size: int,
+        shutdown_timeout: float
+    ) -> None:
+        """
+        :param AsyncIOMotorCollection collection: Collection for the events.
+        :param int batch_size: Number of events that triggers the flush.
+        :param float flush_interval: Maximum time (in seconds) between flushes.
+        :param int max_size: Maximum number of events waiting for the flush.
+        :param float shutdown_timeout: Maximum time (in seconds) of the last flush on stop.
+        """
+        self._collection = collection
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_size = max_size
+        self._shutdown_timeout = shutdown_timeout
+
+        self._events = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._is_stopped = False
+
+        self.dropped_count = 0
+
+    @property
+    def pending_count(self) -> int:
+        """
+        Number of events waiting for the flush.
+
+        :rtype: int
+        """
+        return len(self._events)
+
+    def push(self, event: dict[str, ...]) -> None:
+        """
+        Adds the event to the buffer without waiting for the database.
+
+        :param dict[str, ...] event: The event.
+        :return: None
+        """
+        if len(self._events) >= self._max_size:
+            self.dropped_count += 1
+            return
+
+        self._events.append(event)
+        if len(self._events) >= self._batch_size:
+            self._wakeup.set()
+
+    def _drop_pending(self, batch: list[dict[str, ...]], reason: str | Exception) -> None:
+        """
+        Drops the unwritten batch and all buffered events.
+
+        :param list[dict[str, ...]] batch: The batch that wasn't written.
+        :param str | Exception reason: Why the events are dropped.
+        :return: None
+        """
+        dropped_count = len(batch) + len(self._events)
+        self._events.clear()
+        self.dropped_count += dropped_count
+        LOGGER.error("%d recognition events were dropped: %s", dropped_count, reason)
+
+    def _requeue(self, batch: list[dict[str, ...]]) -> None:
+        """
+        Returns the unwritten batch to the front of the buffer.
+        The newest events over 'max_size' are dropped.
+
+        :param list[dict[str, ...]] batch: The batch that wasn't written.
+        :return: None
+        """
+        self._events.extendleft(reversed(batch))
+
+        overflow_count = len(self._events) - self._max_size
+        for _ in range(overflow_count):
+            self._events.pop()
+        if overflow_count > 0:
+            self.dropped_count += overflow_count
+            LOGGER.error("%d recognition events were dropped: the buffer is full", overflow_count)
+
+    async def flush(self) -> None:
+        """
+        Writes all buffered events to the database by batches.
+        After the first failed write the batch is returned to the buffer
+        and the flush is stopped, so the next one retries it.
+
+        :return: None
+        """
+        while self._events:
+            batch = [
+                self._events.popleft()
+                for _ in range(min(self._batch_size, len(self._events)))
+            ]
+            try:
+                await self._collection.insert_many(batch, ordered=False)
+            except BulkWriteError as error:
+                # The rejected events would be rejected again, so they aren't retried.
+                rejected_count = len(batch) - error.details.get('nInserted', 0)
+                self.dropped_count += rejected_count
+                LOGGER.error("%d recognition events were rejected: %s", rejected_count, error)
+            except PyMongoError as error:
+                self._requeue(batch)
+                LOGGER.warning("Recognition events weren't written, will retry: %s", error)
+                return
+            except asyncio.CancelledError:
+                self._drop_pending(batch, "the flush was cancelled")
+                raise
+            except Exception:
+                # E.g. the events can't be encoded to BSON, so they can't be retried.
+                self.dropped_count += len(batch)
+                LOGGER.exception("%d recognition events were dropped", len(batch))
+
+    async def _run(self) -> None:
+        """
+        Flushes the buffer by size or by interval until the buffer is stopped.
+
+        :return: None
+        """
+        while not self._is_stopped:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                LOGGER.exception("Flushing of recognition events failed")
+
+    def start(self) -> None:
+        """
+        Starts the background flushing in the running event loop.
+
+        :return: None
+        """
+        self._is_stopped = False
+        self._task = asyncio.create_task(self._run())
+
+    async def _drain(self) -> None:
+        """
+        Waits for the background flushing and writes the remaining events.
+
+        :return: None
+        """
+        if self._task:
+            try:
+                await self._task
+            except Exception:
+                LOGGER.exception("Background flushing of recognition events failed")
+        await self.flush()
+
+    async def stop(self) -> None:
+        """
+        Stops the background flushing and writes the remaining events.
+        Events that weren't written in 'shutdown_timeout' seconds are dropped.
+
+        :return: None
+        """
+        self._is_stopped = True
+        self._wakeup.set()
+
+        try:
+            await asyncio.wait_for(self._drain(), timeout=self._shutdown_timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+
+        if self._events:
+            self._drop_pending([], "they weren't written on shutdown")
+
+
+EVENT_BUFFER = EventBuffer(
+    MONGO_DB.recognition_events,
+    batch_size=CONFIG['event_log']['batch_size'],
+    flush_interval=CONFIG['event_log']['flush_interval'],
+    max_size=CONFIG['event_log']['max_buffer_size'],
+    shutdown_timeout=CONFIG['event_log']['shutdown_timeout']
+)
+
+
+def log_recognition_event(
+    client_login: str,
+    employee_id: str | None,
+    distance: float | None,
+    latencies: dict[str, float]
+) -> None:
+    """
+    Adds the identification attempt to the event log.
+
+    :param str client_login: Login of the client who made the request.
+    :param str | None employee_id: ID of the found employee or None.
+    :param float | None distance: Distance to the nearest known encoding or None.
+    :param dict[str, float] latencies: Durations (in milliseconds) of the recognition stages.
+    :return: None
+    """
+    EVENT_BUFFER.push({
+        'client': client_login,
+        'employee_id': employee_id,
+        'distance': distance,
+        'timestamp': datetime.now(tz=timezone.utc),
+        'latencies': latencies
+    })
+
+
+async def create_event_indexes() -> None:
+    """
+    Creates indexes of the event log for the queries of recent events.
+
+    :return: None
+    """
+    await MONGO_DB.recognition_events.create_index([('timestamp', DESCENDING)])
+    await MONGO_DB.recognition_events.create_index(
+        [('employee_id', ASCENDING), ('timestamp', DESCENDING)]
+    )
+    await MONGO_DB.recognition_events.create_index(
+        [('client', ASCENDING), ('timestamp', DESCENDING)]
+    )
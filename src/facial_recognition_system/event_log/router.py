@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, Query
+from pymongo import DESCENDING
+
+from src.facial_recognition_system.database import MONGO_DB
+from src.facial_recognition_system.jwt_auth import get_current_client
+
+from .dependencies import EVENT_BUFFER
+
+
+ROUTER = APIRouter(tags=['Recognition events'], prefix="/events")
+
+
+@ROUTER.get("/")
+async def get_recent(
+        employee_id: str | None = None,
+        client_login: str | None = None,
+        limit: int = Query(100, ge=1, le=1000),
+        client: dict[str, str] = Depends(get_current_client)
+) -> list[dict[str, ...]]:
+    """
+    Returns recent identification attempts, the newest first.
+
+    :param str | None employee_id: If set, only events with this employee are returned.
+    :param str | None client_login: If set, only events from this client are returned.
+    :param int limit: Maximum number of events.
+    :param dict[str, str] client: Data about the client who made the request.
+    :return: Recent recognition events.
+    :rtype: list[dict[str, ...]]
+    """
+    query = {}
+    if employee_id:
+        query['employee_id'] = employee_id
+    if client_login:
+        query['client'] = client_login
+
+    cursor = MONGO_DB.recognition_events.find(query, {'_id': False})
+    return [
+        event
+        async for event in cursor.sort('timestamp', DESCENDING).limit(limit)
+    ]
+
+
+@ROUTER.get("/stats")
+async def get_stats(
+        client: dict[str, str] = Depends(get_current_client)
+) -> dict[str, int]:
+    """
+    Returns the state of the write-behind buffer of events.
+
+    :param dict[str, str] client: Data about the client who made the request.
+    :return: Numbers of pending and dropped events.
+    :rtype: dict[str, int]
+    """
+    return {
+        'pending': EVENT_BUFFER.pending_count,
+        'dropped': EVENT_BUFFER.dropped_count
+    }
@@ -1,9 +1,11 @@
+import uuid
 from typing import BinaryIO
 
 import cv2
 import numpy as np
 import face_recognition as fr
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from src.facial_recognition_system.config import CONFIG
 from src.facial_recognition_system.database import MONGO_DB
@@ -44,30 +46,264 @@ async def encode_img_stream(
     return fr.face_encodings(rgb_layouts, face_boxes)[0].tolist()
 
 
-async def get_employee_by_img(
-    photo_stream: BinaryIO,
-    model_tag: str = 'cnn'
-) -> str | None:
+async def find_employee_by_encoding(
+    unknown_encoding: list[float]
+) -> tuple[str | None, float | None]:
     """
-    Searches for the employee in database of biometrics.
+    Searches for the employee with the encoding in database of biometrics.
 
-    :param BinaryIO photo_stream: The photo as byte string.
-    :param str model_tag: The name of the model that will process the photo.
-                          The 'hog' model is faster, the 'cnn' model is more accurate.
-    :return: ID of the employee or None
-    :rtype: str
+    :param list[float] unknown_encoding: Encoding of the face.
+    :return: ID of the employee (or None) and distance to the nearest encoding
+             of this employee (or of all employees if nobody was found).
+    :rtype: tuple[str | None, float | None]
     """
-    unknown_encoding = await encode_img_stream(photo_stream, model_tag=model_tag)
     unknown_encoding = np.array(unknown_encoding)
+    best_distance = None
 
     async for biometric in MONGO_DB.biometrics.find():
         known_encodings = [
             np.array(encoding)
             for encoding in biometric['encodings']
         ]
+        if not known_encodings:
+            continue
 
-        comparisons = fr.compare_faces(known_encodings, unknown_encoding)
+        # It's the same as 'fr.compare_faces', but the distances are kept.
+        distances = fr.face_distance(known_encodings, unknown_encoding)
+        comparisons = distances <= CONFIG['model']['tolerance']
         probability = sum(comparisons) / len(comparisons)
 
+        min_distance = float(distances.min())
+        if best_distance is None or min_distance < best_distance:
+            best_distance = min_distance
+
         if probability > CONFIG['model']['prob_threshold']:
-            return str(biometric['_id'])
+            return str(biometric['_id']), min_distance
+
+    return None, best_distance
+
+
+def _select_representatives(
+    distances: np.ndarray,
+    max_count: int,
+    epsilon: float
+) -> list[int]:
+    """
+    Selects a diverse subset of encodings by farthest-point sampling.
+    Only encodings within the match tolerance from the medoid are candidates,
+    so outliers (e.g. bad enrollment photos) don't outvote the typical ones.
+
+    :param np.ndarray distances: Pairwise distances between encodings of one employee.
+    :param int max_count: Maximum size of the subset.
+    :param float epsilon: Encodings closer than this distance to the subset aren't selected.
+    :return: Sorted indexes of selected encodings.
+    :rtype: list[int]
+    """
+    # The medoid is the most typical encoding, so it's always kept.
+    medoid_idx = int(np.argmin(distances.sum(axis=1)))
+    is_candidate = distances[medoid_idx] <= CONFIG['model']['tolerance']
+
+    selected = [medoid_idx]
+    nearest = np.where(is_candidate, distances[medoid_idx], -np.inf)
+
+    while len(selected) < max_count:
+        farthest_idx = int(np.argmax(nearest))
+        if nearest[farthest_idx] < epsilon:
+            break
+
+        selected.append(farthest_idx)
+        nearest = np.where(is_candidate, np.minimum(nearest, distances[farthest_idx]), -np.inf)
+
+    return sorted(selected)
+
+
+def _count_passed_votes(distances: np.ndarray, is_known: np.ndarray) -> int:
+    """
+    Counts encodings that would be identified against the known ones
+    by the same vote as in 'find_employee_by_encoding'.
+    Every encoding is excluded from its own vote (leave-one-out).
+
+    :param np.ndarray distances: Pairwise distances between encodings of one employee.
+    :param np.ndarray is_known: Mask of the encodings that are stored.
+    :return: Number of encodings that pass the vote.
+    :rtype: int
+    """
+    voters = np.tile(is_known, (len(is_known), 1))
+    np.fill_diagonal(voters, False)
+
+    voters_count = voters.sum(axis=1)
+    matches_count = (voters & (distances <= CONFIG['model']['tolerance'])).sum(axis=1)
+    probabilities = np.divide(
+        matches_count,
+        voters_count,
+        out=np.zeros(len(is_known)),
+        where=voters_count > 0
+    )
+
+    return int((probabilities > CONFIG['model']['prob_threshold']).sum())
+
+
+def _pairwise_distances(encodings: np.ndarray) -> np.ndarray:
+    """
+    Computes euclidean distances between all encodings.
+    The Gram identity is used, so there is no n*n*128 intermediate array.
+
+    :param np.ndarray encodings: Encodings of one employee as 2D array.
+    :return: Pairwise distances between encodings.
+    :rtype: np.ndarray
+    """
+    squared_norms = (encodings ** 2).sum(axis=1)
+    squared_distances = (
+        squared_norms[:, np.newaxis]
+        + squared_norms[np.newaxis]
+        - 2 * encodings @ encodings.T
+    )
+    distances = np.sqrt(np.clip(squared_distances, 0, None))
+    np.fill_diagonal(distances, 0)
+
+    return distances
+
+
+def compact_encodings(
+    encodings: list[list[float]],
+    max_count: int = CONFIG['model']['max_encodings'],
+    epsilon: float = CONFIG['model']['dedup_epsilon']
+) -> tuple[list[list[float]], dict[str, int | float]]:
+    """
+    Reduces encodings of the employee to a diverse representative set.
+    It's CPU-bound, so it should be run in the thread pool.
+
+    :param list[list[float]] encodings: Encodings of the employee.
+    :param int max_count: Maximum number of encodings after compaction.
+    :param float epsilon: Encodings closer than this distance to each other are merged.
+    :return: Compacted encodings and the report about removed vectors.
+             'passed_before' and 'passed_after' are the numbers of original encodings
+             that pass the identification vote against the original and compacted sets.
+             The distances are between each original encoding and the nearest kept one.
+    :rtype: tuple[list[list[float]], dict[str, int | float]]
+    """
+    if not encodings or max_count <= 0:
+        return [], {
+            'before': len(encodings),
+            'after': 0,
+            'removed': len(encodings),
+            'passed_before': 0,
+            'passed_after': 0,
+            'mean_distance': 0.0,
+            'max_distance': 0.0
+        }
+
+    distances = _pairwise_distances(np.array(encodings))
+
+    selected = _select_representatives(distances, max_count, epsilon)
+    compacted = [encodings[idx] for idx in selected]
+
+    is_kept = np.zeros(len(encodings), dtype=bool)
+    is_kept[selected] = True
+    nearest = distances[:, selected].min(axis=1)
+
+    return compacted, {
+        'before': len(encodings),
+        'after': len(compacted),
+        'removed': len(encodings) - len(compacted),
+        'passed_before': _count_passed_votes(distances, np.ones(len(encodings), dtype=bool)),
+        'passed_after': _count_passed_votes(distances, is_kept),
+        'mean_distance': float(nearest.mean()),
+        'max_distance': float(nearest.max())
+    }
+
+
+async def merge_encodings(
+    existing_encodings: list[list[float]],
+    new_encodings: list[list[float]],
+    max_count: int = CONFIG['model']['max_encodings'],
+    epsilon: float = CONFIG['model']['dedup_epsilon']
+) -> tuple[list[list[float]], dict[str, int]]:
+    """
+    Adds new encodings to existing ones, skipping near-duplicates.
+    New encodings are never dropped as outliers (e.g. the employee
+    has got glasses), the room for them is taken from the existing ones.
+
+    :param list[list[float]] existing_encodings: Stored encodings of the employee.
+    :param list[list[float]] new_encodings: Encodings from the uploaded photos.
+    :param int max_count: Maximum number of encodings of the employee.
+    :param float epsilon: New encodings closer than this distance to the stored ones are skipped.
+    :return: Merged encodings and the numbers of skipped new encodings,
+             removed encodings (existing ones and new ones over the limit) and stored encodings.
+    :rtype: tuple[list[list[float]], dict[str, int]]
+    """
+    accepted_encodings = []
+    skipped_count = 0
+
+    for new_encoding in new_encodings:
+        known_encodings = existing_encodings + accepted_encodings
+        if known_encodings:
+            distances = fr.face_distance(np.array(known_encodings), np.array(new_encoding))
+            if distances.min() < epsilon:
+                skipped_count += 1
+                continue
+
+        accepted_encodings.append(new_encoding)
+
+    removed_count = max(len(accepted_encodings) - max_count, 0)
+    accepted_encodings = accepted_encodings[:max_count]
+
+    kept_encodings = existing_encodings
+    room = max_count - len(accepted_encodings)
+    if len(existing_encodings) > room:
+        kept_encodings, _ = await run_in_threadpool(
+            compact_encodings,
+            existing_encodings,
+            max_count=room,
+            epsilon=epsilon
+        )
+        removed_count += len(existing_encodings) - len(kept_encodings)
+
+    merged_encodings = kept_encodings + accepted_encodings
+    return merged_encodings, {
+        'skipped': skipped_count,
+        'removed': removed_count,
+        'stored': len(merged_encodings)
+    }
+
+
+async def compact_biometrics(employee_id: uuid.UUID | None = None) -> list[dict[str, ...]]:
+    """
+    Compacts stored encodings of one employee or of all employees.
+
+    :param uuid.UUID | None employee_id: ID of the employee. If None, all employees are compacted.
+    :return: Reports about compaction of every processed employee.
+             If 'applied' is False, the encodings are kept as is and 'reason' explains why.
+    :rtype: list[dict[str, ...]]
+    """
+    query = {'_id': employee_id} if employee_id else {}
+    reports = []
+
+    async for biometric in MONGO_DB.biometrics.find(query):
+        compacted, report = await run_in_threadpool(compact_encodings, biometric['encodings'])
+        report.update({
+            '_id': str(biometric['_id']),
+            'applied': False,
+            'reason': None
+        })
+        reports.append(report)
+
+        if not report['removed']:
+            report['reason'] = "There is nothing to remove."
+            continue
+
+        if report['passed_after'] < report['passed_before']:
+            report['reason'] = "The compaction makes identification worse."
+            continue
+
+        # The encodings may be changed by enrollment during the compaction,
+        # then the compacted encodings aren't written.
+        result = await MONGO_DB.biometrics.update_one(
+            {'_id': biometric['_id'], 'encodings': biometric['encodings']},
+            {'$set': {'encodings': compacted}}
+        )
+        report['applied'] = bool(result.modified_count)
+        if not report['applied']:
+            report['reason'] = "The encodings were changed during the compaction."
+
+    return reports
@@ -1,3 +1,4 @@
+import time
 import uuid
 
 from fastapi import (
@@ -10,28 +11,69 @@ from fastapi import (
 
 from src.facial_recognition_system.config import CONFIG
 from src.facial_recognition_system.database import MONGO_DB
+from src.facial_recognition_system.event_log import log_recognition_event
 from src.facial_recognition_system.jwt_auth import get_current_client
 
-from .dependencies import encode_img_stream, get_employee_by_img
+from .dependencies import (
+    encode_img_stream,
+    find_employee_by_encoding,
+    merge_encodings,
+    compact_biometrics
+)
 
 
 ROUTER = APIRouter(tags=['Face recognition'], prefix="/biometrics")
 
 
+@ROUTER.post("/compact")
+async def compact_all(
+        client: dict[str, str] = Depends(get_current_client)
+) -> list[dict[str, ...]]:
+    """
+    Compacts encodings of biometrics of all employees.
+
+    :param dict[str, str] client: Data about the client who made the request.
+    :return: Reports about compaction of every employee.
+    :rtype: list[dict[str, ...]]
+    """
+    return await compact_biometrics()
+
+
+@ROUTER.post("/{employee_id}/compact")
+async def compact(
+        employee_id: str,
+        client: dict[str, str] = Depends(get_current_client)
+) -> dict[str, ...]:
+    """
+    Compacts encodings of biometrics of the employee to a diverse representative set.
+
+    :param str employee_id: ID of the employee.
+    :param dict[str, str] client: Data about the client who made the request.
+    :return: Report about removed encodings and the effect on match distance.
+    :rtype: dict[str, ...]
+    """
+    reports = await compact_biometrics(uuid.UUID(employee_id))
+    if not reports:
+        raise HTTPException(status_code=404, detail="The employee has no biometrics.")
+
+    return reports[0]
+
+
 @ROUTER.post("/{employee_id}")
 async def create(
         employee_id: str,
         photos: list[UploadFile] = File(...),
         client: dict[str, str] = Depends(get_current_client)
-) -> dict[str, str]:
+) -> dict[str, str | int]:
     """
     Adds new encodings of biometrics to the employee data.
+    Encodings that are too close to the existing ones are skipped.
 
     :param str employee_id: ID of the employee.
     :param list[UploadFile] photos: Uploaded photos of the employee.
     :param dict[str, str] client: Data about the client who made the request.
-    :return: ID of the employee.
-    :rtype: None
+    :return: ID of the employee and the numbers of skipped, removed and stored encodings.
+    :rtype: dict[str, str | int]
     """
     employee = await MONGO_DB.employees.find_one({'_id': uuid.UUID(employee_id)})
     if not employee:
@@ -46,18 +88,22 @@ async def create(
         {'_id': uuid.UUID(employee_id)}
     )
     if existing_biometrics:
-        existing_biometrics['encodings'] += new_encodings
+        existing_biometrics['encodings'], merge_report = await merge_encodings(
+            existing_biometrics['encodings'],
+            new_encodings
+        )
         await MONGO_DB.biometrics.replace_one(
             {'_id': uuid.UUID(employee_id)},
             existing_biometrics
         )
     else:
+        encodings, merge_report = await merge_encodings([], new_encodings)
         await MONGO_DB.biometrics.insert_one({
             '_id': uuid.UUID(employee_id),
-            'encodings': new_encodings
+            'encodings': encodings
         })
 
-    return {'_id': employee_id}
+    return {'_id': employee_id, **merge_report}
 
 
 @ROUTER.patch("/{employee_id}")
@@ -79,15 +125,16 @@ async def update(
     if not employee:
         raise HTTPException(status_code=401, detail="Invalid ID of the employee.")
 
+    new_encodings = [
+        await encode_img_stream(
+            photo.file,
+            model_tag=CONFIG['model']['model_tag']
+        )
+        for photo in photos
+    ]
     new_biometrics = {
         '_id': uuid.UUID(employee_id),
-        'encodings': [
-            await encode_img_stream(
-                photo.file,
-                model_tag=CONFIG['model']['model_tag']
-            )
-            for photo in photos
-        ]
+        'encodings': (await merge_encodings([], new_encodings))[0]
     }
     await MONGO_DB.biometrics.delete_one({'_id': uuid.UUID(employee_id)})
     await MONGO_DB.biometrics.insert_one(new_biometrics)
@@ -108,14 +155,37 @@ async def find(
     :return: ID of the employee.
     :rtype: dict[str, str]
     """
-    employee_id = await get_employee_by_img(
-        photo.file,
-        model_tag=CONFIG['model']['model_tag']
+    started_at = time.perf_counter()
+    try:
+        unknown_encoding = await encode_img_stream(
+            photo.file,
+            model_tag=CONFIG['model']['model_tag']
+        )
+    except HTTPException:
+        log_recognition_event(
+            client['login'],
+            None,
+            None,
+            {'encoding_ms': (time.perf_counter() - started_at) * 1000}
+        )
+        raise
+    encoded_at = time.perf_counter()
+
+    employee_id, distance = await find_employee_by_encoding(unknown_encoding)
+    matched_at = time.perf_counter()
+
+    # The event is only buffered here, it's written to database in background.
+    log_recognition_event(
+        client['login'],
+        employee_id,
+        distance,
+        {
+            'encoding_ms': (encoded_at - started_at) * 1000,
+            'matching_ms': (matched_at - encoded_at) * 1000
+        }
     )
+
     if employee_id:
         return {'_id': employee_id}
 
     raise HTTPException(status_code=401, detail="The employee wasn't found.")
-
-
-
@@ -1,17 +1,53 @@
+import logging
+
 import uvicorn
 from fastapi import FastAPI
+from pymongo.errors import PyMongoError
 
 from src.facial_recognition_system.config import CONFIG, LOG_CONFIG_PATH
 from src.facial_recognition_system.employee import EMPLOYEE_ROUTER
+from src.facial_recognition_system.event_log import (
+    EVENT_BUFFER,
+    EVENT_ROUTER,
+    create_event_indexes
+)
 from src.facial_recognition_system.face_auth import FACE_ROUTER
 from src.facial_recognition_system.jwt_auth import create_clients, JWT_ROUTER
 
 
+LOGGER = logging.getLogger(__name__)
+
 FRS_APP = FastAPI(title="Facial Recognition System (FastAPI + OpenCV)")
-for router in (JWT_ROUTER, EMPLOYEE_ROUTER, FACE_ROUTER):
+for router in (JWT_ROUTER, EMPLOYEE_ROUTER, FACE_ROUTER, EVENT_ROUTER):
     FRS_APP.include_router(router)
 
 
+@FRS_APP.on_event("startup")
+async def startup() -> None:
+    """
+    Prepares the event log and starts its background flushing.
+    The application starts even if the database is unavailable.
+
+    :return: None
+    """
+    try:
+        await create_event_indexes()
+    except PyMongoError as error:
+        LOGGER.error("Indexes of the event log weren't created: %s", error)
+
+    EVENT_BUFFER.start()
+
+
+@FRS_APP.on_event("shutdown")
+async def shutdown() -> None:
+    """
+    Writes the remaining events of the event log to database.
+
+    :return: None
+    """
+    await EVENT_BUFFER.stop()
+
+
 if __name__ == '__main__':
     create_clients()
 